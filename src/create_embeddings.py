@@ -1,24 +1,14 @@
-"""Utility to generate player profile embeddings for Neo4j vector search.
-
-*** DEBUGGING VERSION ***
-This version focuses ONLY on the failing 'minilm' model to diagnose the error.
-"""
+"""Utility to generate player profile embeddings for Neo4j vector search."""
 
+import asyncio
 import os
 from typing import List, Tuple
 
-from langchain_community.vectorstores import Neo4jVector
-from langchain_huggingface import HuggingFaceEmbeddings
-from neo4j import GraphDatabase
+from neo4j import AsyncGraphDatabase
 
 from config import NEO4J_PASSWORD, NEO4J_URI, NEO4J_USER, HF_TOKEN
 
 # --- CONFIGURATION ---
-HF_TOKEN = os.environ.get("HUGGINGFACEHUB_API_TOKEN", HF_TOKEN)
-if "HUGGINGFACEHUB_API_TOKEN" not in os.environ:
-    os.environ["HUGGINGFACEHUB_API_TOKEN"] = HF_TOKEN
-
-# We are only testing the failing model configuration
 MODEL_CONFIGS = [
     {
         "model_name": "BAAI/bge-small-en-v1.5",
@@ -31,15 +21,118 @@ MODEL_CONFIGS = [
         "embedding_property": "embedding_minilm" # <--- New unique property name
     }
 ]
-NODE_LABEL = "player_info" 
+NODE_LABEL = "player_info"
+
+# Players fetched per UNWIND batch; keeps the server-side intermediate
+# aggregation stream bounded instead of materializing every
+# (Player)-[:PLAYED_IN]->(Fixture) row at once.
+FETCH_BATCH_SIZE = 500
+
+# Rows written to Neo4j per upsert transaction. One giant transaction hits
+# HNSW batch-commit cliffs; a few hundred rows per commit keeps throughput
+# flat. Tunable without a code change for differently-sized imports.
+INGEST_BATCH_SIZE = int(os.environ.get("FPL_INGEST_BATCH_SIZE", "500"))
+
+# Both configured models emit 384-dim sentence embeddings.
+VECTOR_DIMENSIONS = 384
+
+# Single-round-trip bulk upsert. db.create.setNodeVectorProperty stores the
+# embedding as a native FP32 vector instead of the FP64 list the driver would
+# otherwise coerce it to. The embedding property name is parameterized; the
+# node label is a trusted module constant.
+UPSERT_QUERY = f"""
+    UNWIND $rows AS row
+    MERGE (n:{NODE_LABEL} {{player_name: row.id}})
+    SET n.text = row.text
+    WITH n, row
+    CALL db.create.setNodeVectorProperty(n, $prop, row.emb)
+    RETURN count(*)
+"""
+
+_DRIVER = None
+
+
+def get_driver():
+    """Return the shared async Neo4j driver, creating it lazily.
+
+    One pooled driver per process avoids repeating the TLS/auth handshake for
+    every call, and the async API pipelines the batched fetches and upserts.
+    The pooled connections are transports bound to the event loop that
+    created them, so the driver must be used and closed (close_driver) inside
+    that one loop.
+    """
+    global _DRIVER
+    if _DRIVER is None:
+        _DRIVER = AsyncGraphDatabase.driver(
+            NEO4J_URI,
+            auth=(NEO4J_USER, NEO4J_PASSWORD),
+            max_connection_pool_size=50,
+            connection_acquisition_timeout=30,
+        )
+    return _DRIVER
+
+
+async def close_driver():
+    """Close the shared driver from within the loop that created it."""
+    global _DRIVER
+    if _DRIVER is not None:
+        await _DRIVER.close()
+        _DRIVER = None
+
+# Batched encoding saturates the matmul kernels instead of paying tokenizer
+# overhead per profile; default LangChain behaviour embeds 32 texts at a time.
+EMBED_BATCH_SIZE = 256
+
+_EMBEDDING_MODELS = {}
+
+
+def _ensure_hf_token():
+    """Propagate the configured token (if any) to the canonical variable."""
+    if HF_TOKEN:
+        os.environ.setdefault("HUGGINGFACEHUB_API_TOKEN", HF_TOKEN)
+
+
+def get_embedding_model(model_name: str):
+    """Return a memoized HuggingFaceEmbeddings instance for `model_name`."""
+
+    if model_name not in _EMBEDDING_MODELS:
+        # Imported lazily so modules that only need the fetch helpers don't pay
+        # for torch/transformers at import time.
+        import torch
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        model_kwargs = {"device": device}
+        if device == "cuda":
+            # FP16 halves the activation/weight bandwidth of the embedding
+            # pass; CPU kernels are slower in half precision so keep FP32 there.
+            model_kwargs["model_kwargs"] = {"torch_dtype": torch.float16}
+        _EMBEDDING_MODELS[model_name] = HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs=model_kwargs,
+            encode_kwargs={
+                "batch_size": EMBED_BATCH_SIZE,
+                # Vectors are normalized once here, so the index can use the
+                # 'dot' similarity function and skip per-query normalization
+                # entirely (dot == cosine for unit vectors).
+                "normalize_embeddings": True,
+            },
+        )
+    return _EMBEDDING_MODELS[model_name]
 
 
-def fetch_player_profiles(driver) -> List[Tuple[str, str]]:
-    """Return (id, profile_text) pairs describing each player."""
+async def fetch_player_profiles(driver, season=None) -> List[Tuple[str, str]]:
+    """Return (id, profile_text) pairs describing each player.
 
-    # Using the same query as before
+    When `season` is given, profiles cover only that season.
+    """
+
+    # Same aggregation as before, but scoped to a batch of player names so the
+    # server never holds the whole intermediate stream in memory.
     fetch_query = """
-        MATCH (p:Player)-[r:PLAYED_IN]->(f:Fixture)
+        UNWIND $ids AS pid
+        MATCH (p:Player {player_name: pid})-[r:PLAYED_IN]->(f:Fixture)
+        WHERE $season IS NULL OR f.season = $season
         MATCH (p)-[:PLAYS_AS]->(pos:Position)
         WITH p, pos, f.season AS season,  // <--- 1. Group by season here so it's available
             sum(r.total_points) as total_points,
@@ -59,56 +152,120 @@ def fetch_player_profiles(driver) -> List[Tuple[str, str]]:
         RETURN p.player_name AS id, text_description AS text
     """
 
-    profiles: List[Tuple[str, str]] = []
-    with driver.session() as session:
-        for record in session.run(fetch_query):
-            profiles.append((record["id"], record["text"]))
-    return profiles
+    async with driver.session() as session:
+        result = await session.run("MATCH (p:Player) RETURN collect(p.player_name) AS ids")
+        ids = (await result.single())["ids"]
+
+    async def fetch_chunk(chunk):
+        async with driver.session() as session:
+            result = await session.run(fetch_query, ids=chunk, season=season)
+            # .values() decodes each result in one batched pass instead of
+            # marshaling one Record at a time through the Python driver.
+            return await result.values("id", "text")
+
+    chunks = [ids[start:start + FETCH_BATCH_SIZE]
+              for start in range(0, len(ids), FETCH_BATCH_SIZE)]
+    batches = await asyncio.gather(*(fetch_chunk(chunk) for chunk in chunks))
+    return [row for batch in batches for row in batch]
+
+
+async def ingest_model_embeddings(driver, config, texts, metadatas):
+    """Embed `texts` with one model config and bulk-upsert them into Neo4j."""
+
+    model = get_embedding_model(config["model_name"])
+    embedding_property = config["embedding_property"]
+
+    # Index names/labels cannot be parameterized in Cypher; all values here
+    # come from MODEL_CONFIGS, not user input.
+    index_query = f"""
+        CREATE VECTOR INDEX {config["index_name"]} IF NOT EXISTS
+        FOR (n:{NODE_LABEL}) ON (n.{embedding_property})
+        OPTIONS {{ indexConfig: {{
+            `vector.dimensions`: {VECTOR_DIMENSIONS},
+            `vector.similarity_function`: 'dot'
+        }} }}
+    """
+
+    async with driver.session() as session:
+        await (await session.run(index_query)).consume()
+
+        for start in range(0, len(texts), INGEST_BATCH_SIZE):
+            end = start + INGEST_BATCH_SIZE
+            chunk_texts = texts[start:end]
+            # embed_documents batches internally per EMBED_BATCH_SIZE. Run it
+            # in a worker thread so one model's encode pass can overlap the
+            # other model's Neo4j writes when passes run concurrently.
+            embeddings = await asyncio.to_thread(model.embed_documents, chunk_texts)
+            rows = [
+                {"id": meta["player_name"], "text": text, "emb": emb}
+                for meta, text, emb in zip(metadatas[start:end], chunk_texts, embeddings)
+            ]
+            result = await session.run(UPSERT_QUERY, rows=rows, prop=embedding_property)
+            await result.consume()
+            print(f"  ... ingested {min(end, len(texts))}/{len(texts)} profiles")
 
 
-def create_player_embeddings():
-    """Create the Neo4j vector index for the configured model, with explicit error logging."""
+async def _create_player_embeddings(season=None):
+    """Async body of create_player_embeddings; runs end to end in one loop."""
 
     print("--- 1. Connecting to Neo4j ---")
-    driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+    driver = get_driver()
 
     print("--- 2. Fetching Player Data & Constructing Text ---")
-    player_profiles = fetch_player_profiles(driver)
+    player_profiles = await fetch_player_profiles(driver, season=season)
     print(f"Prepared {len(player_profiles)} player profiles for embedding.")
 
-    for config in MODEL_CONFIGS:
+    # Build the texts/metadatas lists once and reuse them for every model pass.
+    texts = [profile for _, profile in player_profiles]
+    metadatas = [{"player_name": player} for player, _ in player_profiles]
+
+    async def ingest_one(config):
         model_name = config["model_name"]
         index_name = config["index_name"]
-        
+
         print(f"\n--- 3. STARTING EMBEDDING GENERATION AND INDEXING for {model_name} ({index_name}) ---")
 
         try:
-            # This is the line that generates vectors and creates the index
-            Neo4jVector.from_texts(
-                texts=[profile for _, profile in player_profiles],
-                metadatas=[{"player_name": player} for player, _ in player_profiles],
-                embedding=HuggingFaceEmbeddings(model_name=model_name),
-                url=NEO4J_URI,
-                username=NEO4J_USER,
-                password=NEO4J_PASSWORD,
-                index_name=index_name,
-                node_label=NODE_LABEL,
-                text_node_property="text",
-                embedding_node_property=config["embedding_property"],
-            )
+            await ingest_model_embeddings(driver, config, texts, metadatas)
             print(f"SUCCESS! Vector Index '{index_name}' created or updated.")
-        except Exception as e:
+        except Exception:
             # IMPORTANT: Print the detailed error traceback to diagnose the issue
             import traceback
             print(f"FATAL ERROR: Index creation for {index_name} FAILED.")
             print("--- TRACEBACK ---")
             traceback.print_exc()
             print("-----------------")
-        finally:
-            pass
-            
-    driver.close()
+
+    # Both passes share the same texts list; running them concurrently
+    # overlaps one model's encode compute with the other's Neo4j I/O wait.
+    await asyncio.gather(*(ingest_one(config) for config in MODEL_CONFIGS))
+
+
+def create_player_embeddings(season=None):
+    """Create the Neo4j vector index for each configured model, with explicit error logging.
+
+    The whole pipeline -- fetch, embed, upsert, driver close -- runs under a
+    single asyncio.run: the async driver's pooled connections only work on
+    the loop that opened them, so splitting the passes across loops would
+    hand later stages dead connections.
+    """
+
+    _ensure_hf_token()
+    asyncio.run(_run_pipeline(season=season))
+
+
+async def _run_pipeline(season=None):
+    try:
+        await _create_player_embeddings(season=season)
+    finally:
+        await close_driver()
 
 
 if __name__ == "__main__":
-    create_player_embeddings()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate player profile embeddings.")
+    parser.add_argument("--season", default=None,
+                        help="Restrict profiles to one season (e.g. 2022-23); default is all seasons.")
+    args = parser.parse_args()
+    create_player_embeddings(season=args.season)
\ No newline at end of file
@@ -1,13 +1,17 @@
 """
 Library of Cypher Query Templates for the FPL Agent.
 UPDATED: Optimized for User's Schema (No Value/Ownership, Heavy on ICT/Stats).
+
+Templates assume the indexes created by graph_setup (name_lower TEXT indexes
+plus the migrations under src/migrations/) exist; run graph_setup.py once
+after loading data.
 """
 
 CYPHER_TEMPLATES = {
     # 1. PLAYER SUMMARY (Added Bonus, BPS, ICT)
     "player_summary": """
         MATCH (p:Player)-[r:PLAYED_IN]->(f:Fixture {season: $season})
-        WHERE toLower(p.player_name) CONTAINS toLower($player_name)
+        WHERE p.player_name_lower CONTAINS $player_name
         RETURN p.player_name AS Player,
                sum(r.total_points) AS TotalPoints,
                sum(r.goals_scored) AS Goals,
@@ -16,12 +20,13 @@ CYPHER_TEMPLATES = {
                sum(r.bonus) AS BonusPoints,
                sum(r.bps) AS BPS,
                sum(r.ict_index) AS TotalICT
+        LIMIT toInteger($limit)
     """,
 
     # 2. TOP PLAYERS BY POSITION (Standard Leaderboard)
     "top_players_by_position": """
         MATCH (p:Player)-[:PLAYS_AS]->(pos:Position)
-        WHERE toLower(pos.name) = toLower($position) OR toLower(pos.name) = toLower($position_mapped)
+        WHERE pos.name_lower = $position OR pos.name_lower = $position_mapped
         MATCH (p)-[r:PLAYED_IN]->(f:Fixture {season: $season})
         WITH p, pos, sum(coalesce(r.total_points, 0)) AS TotalPoints
         ORDER BY TotalPoints DESC
@@ -32,24 +37,24 @@ CYPHER_TEMPLATES = {
     # 3. PLAYER VS TEAM (Added Threat/Creativity to see playstyle)
     "player_vs_team": """
         MATCH (p:Player)-[r:PLAYED_IN]->(f:Fixture {season: $season})
-        WHERE toLower(p.player_name) CONTAINS toLower($player_name)
+        WHERE p.player_name_lower CONTAINS $player_name
         MATCH (f)-[:HAS_HOME_TEAM|HAS_AWAY_TEAM]->(t:Team)
-        WHERE toLower(t.name) CONTAINS toLower($opponent)
+        WHERE t.name_lower CONTAINS $opponent
         RETURN p.player_name AS Player,
                f.fixture_number AS GW,
                t.name AS Opponent,
                r.total_points AS Points,
                r.goals_scored AS Goals,
                r.ict_index AS ICT_Index
+        LIMIT toInteger($limit)
     """,
 
     # 4. SQUAD LIST (Unchanged)
     "team_squad_by_position": """
-        MATCH (t:Team) WHERE toLower(t.name) CONTAINS toLower($team)
-        MATCH (p:Player)-[:PLAYS_AS]->(pos:Position)
-        WHERE toLower(pos.name) = toLower($position) OR toLower(pos.name) = toLower($position_mapped)
-        MATCH (p)-[r:PLAYED_IN]->(f:Fixture {season: $season})
-        MATCH (f)-[:HAS_HOME_TEAM|HAS_AWAY_TEAM]->(t)
+        MATCH (t:Team)<-[:HAS_HOME_TEAM|HAS_AWAY_TEAM]-(f:Fixture {season: $season})
+              <-[r:PLAYED_IN]-(p:Player)-[:PLAYS_AS]->(pos:Position)
+        WHERE t.name_lower CONTAINS $team
+          AND (pos.name_lower = $position OR pos.name_lower = $position_mapped)
         WITH p, pos, t, sum(r.total_points) as TotalPoints
         ORDER BY TotalPoints DESC
         RETURN t.name AS Team, p.player_name AS Player, pos.name AS Position, TotalPoints
@@ -57,29 +62,53 @@ CYPHER_TEMPLATES = {
     """,
 
     # 5. COMPARE PLAYERS (Added Underlying Stats: ICT, Threat, Creativity)
+    # Season totals AND last-5 form come back in one Bolt round trip: two
+    # subqueries per matched player instead of a second template call when
+    # the user asks about both.
     "compare_players": """
-        MATCH (p:Player)-[r:PLAYED_IN]->(f:Fixture {season: $season})
-        WHERE any(name IN $player_names WHERE toLower(p.player_name) CONTAINS toLower(name))
+        MATCH (p:Player)
+        WHERE any(name IN $player_names WHERE p.player_name_lower CONTAINS name)
+        CALL {
+            WITH p
+            MATCH (p)-[r:PLAYED_IN]->(:Fixture {season: $season})
+            RETURN sum(r.total_points) AS TotalPoints,
+                   sum(r.goals_scored) AS Goals,
+                   sum(r.assists) AS Assists,
+                   sum(r.minutes) AS Minutes,
+                   sum(r.ict_index) AS Total_ICT,
+                   sum(r.threat) AS Total_Threat,
+                   sum(r.creativity) AS Total_Creativity
+        }
+        CALL {
+            WITH p
+            MATCH (p)-[r:PLAYED_IN]->(f:Fixture {season: $season})
+            WITH r ORDER BY f.fixture_number DESC LIMIT 5
+            RETURN sum(r.total_points) AS Points_Last_5,
+                   sum(r.goals_scored) AS Goals_Last_5,
+                   sum(r.ict_index) AS ICT_Last_5
+        }
         RETURN p.player_name AS Player,
-               sum(r.total_points) AS TotalPoints,
-               sum(r.goals_scored) AS Goals,
-               sum(r.assists) AS Assists,
-               sum(r.minutes) AS Minutes,
-               sum(r.ict_index) AS Total_ICT,
-               sum(r.threat) AS Total_Threat,
-               sum(r.creativity) AS Total_Creativity
+               TotalPoints, Goals, Assists, Minutes,
+               Total_ICT, Total_Threat, Total_Creativity,
+               Points_Last_5, Goals_Last_5, ICT_Last_5
+        LIMIT toInteger($limit)
     """,
 
     # 6. COMPARE RECENT FORM (Last 5 Games - Critical for decisions)
     "compare_players_last_5": """
-        MATCH (p:Player)-[r:PLAYED_IN]->(f:Fixture {season: $season})
-        WHERE any(name IN $player_names WHERE toLower(p.player_name) CONTAINS toLower(name))
-        WITH p, f, r ORDER BY f.fixture_number DESC
-        WITH p, collect(r)[0..5] as recent_games
+        MATCH (p:Player)
+        WHERE any(name IN $player_names WHERE p.player_name_lower CONTAINS name)
+        CALL {
+            WITH p
+            MATCH (p)-[r:PLAYED_IN]->(f:Fixture {season: $season})
+            RETURN r ORDER BY f.fixture_number DESC LIMIT 5
+        }
+        WITH p, collect(r) as recent_games
         RETURN p.player_name AS Player,
                reduce(s=0, x in recent_games | s + x.total_points) as Points_Last_5,
                reduce(s=0, x in recent_games | s + x.goals_scored) as Goals_Last_5,
                reduce(s=0, x in recent_games | s + x.ict_index) as ICT_Last_5
+        LIMIT toInteger($limit)
     """,
 
     # 7. TEAM PERFORMANCE IN GW
@@ -87,14 +116,13 @@ CYPHER_TEMPLATES = {
         MATCH (s:Season {season_name: $season})-[:HAS_GW]->(g:Gameweek {GW_number: toInteger($gw)})
         MATCH (g)-[:HAS_FIXTURE]->(f:Fixture)
         MATCH (t:Team)<-[:HAS_HOME_TEAM|HAS_AWAY_TEAM]-(f)
-        WHERE toLower(t.name) CONTAINS toLower($team)
+        WHERE t.name_lower CONTAINS $team
         MATCH (f)-[:HAS_HOME_TEAM|HAS_AWAY_TEAM]->(opponent:Team)
         WHERE opponent.name <> t.name
         MATCH (p:Player)-[r:PLAYED_IN]->(f)
-        MATCH (p)-[:PLAYED_IN]->(f_all:Fixture {season: $season})
-        MATCH (f_all)-[:HAS_HOME_TEAM|HAS_AWAY_TEAM]->(t)
-        WITH g, t, opponent, p, r, count(f_all) as squad_games
-        WHERE squad_games > 2
+        // Precomputed by graph_setup.ensure_squad_relationships; replaces a
+        // full re-scan of each player's season just to filter squad members.
+        MATCH (p)-[:SQUAD_OF {season: $season}]->(t)
         WITH g, t, opponent, sum(r.goals_scored) as TeamGoals, sum(r.total_points) as TeamPoints, collect(p.player_name)[0..3] as KeyPlayers
         RETURN t.name AS Team, g.GW_number AS GW, opponent.name AS Opponent, TeamGoals, TeamPoints, KeyPlayers
     """,
@@ -103,10 +131,13 @@ CYPHER_TEMPLATES = {
     # Finds players with High ICT Index (Underlying Stats) in last 3 games
     "recommend_differentials": """
         MATCH (p:Player)-[:PLAYS_AS]->(pos:Position)
-        WHERE toLower(pos.name) = toLower($position) OR toLower(pos.name) = toLower($position_mapped)
-        MATCH (p)-[r:PLAYED_IN]->(f:Fixture {season: $season})
-        WITH p, pos, r ORDER BY f.fixture_number DESC
-        WITH p, pos, collect(r)[0..3] as last_3
+        WHERE pos.name_lower = $position OR pos.name_lower = $position_mapped
+        CALL {
+            WITH p
+            MATCH (p)-[r:PLAYED_IN]->(f:Fixture {season: $season})
+            RETURN r ORDER BY f.fixture_number DESC LIMIT 3
+        }
+        WITH p, pos, collect(r) as last_3
         WITH p, pos, 
              reduce(s=0, x in last_3 | s + x.total_points) as form_points,
              reduce(s=0, x in last_3 | s + x.ict_index) as form_ict
@@ -120,13 +151,18 @@ CYPHER_TEMPLATES = {
     """,
 
     # 9. BEST CAPTAIN OPTIONS (Uses Form + ICT)
+    # The subquery projects the two scalars it needs instead of whole
+    # relationship objects, so the per-player top-3 stays index-backed and
+    # only numbers cross the subquery boundary.
     "best_captain_options": """
-        MATCH (p:Player)-[r:PLAYED_IN]->(f:Fixture {season: $season})
-        WITH p, r ORDER BY f.fixture_number DESC
-        WITH p, collect(r)[0..3] as last_3_games
-        WITH p, 
-             reduce(s = 0, x IN last_3_games | s + x.total_points) as form_points,
-             reduce(s = 0, x IN last_3_games | s + x.ict_index) as form_ict
+        MATCH (p:Player)
+        CALL {
+            WITH p
+            MATCH (p)-[r:PLAYED_IN]->(f:Fixture {season: $season})
+            RETURN r.total_points AS pts, r.ict_index AS ict
+            ORDER BY f.fixture_number DESC LIMIT 3
+        }
+        WITH p, sum(pts) as form_points, sum(ict) as form_ict
         ORDER BY form_points + form_ict DESC
         LIMIT 5
         RETURN p.player_name AS Player, form_points AS PointsLast3, form_ict as ICTLast3
@@ -135,18 +171,28 @@ CYPHER_TEMPLATES = {
     # 10. AVAILABILITY CHECK
     "player_availability_check": """
         MATCH (p:Player)-[r:PLAYED_IN]->(f:Fixture {season: $season})
-        WHERE toLower(p.player_name) CONTAINS toLower($player_name)
+        WHERE p.player_name_lower CONTAINS $player_name
         WITH p, r, f ORDER BY f.fixture_number DESC LIMIT 3
         RETURN p.player_name AS Player, collect(r.minutes) as Last3Minutes
+        LIMIT toInteger($limit)
     """,
     
     # 11. HIGHEST SCORING GW
     "highest_scoring_gw": """
-        MATCH (p:Player)-[r:PLAYED_IN]->(f:Fixture {season: $season})
-        WHERE toLower(p.player_name) CONTAINS toLower($player_name)
-        MATCH (s:Season)-[:HAS_GW]->(g:Gameweek)-[:HAS_FIXTURE]->(f)
+        MATCH (p:Player)-[r:PLAYED_IN]->(f:Fixture {season: $season})<-[:HAS_FIXTURE]-(g:Gameweek)
+        WHERE p.player_name_lower CONTAINS $player_name
         RETURN p.player_name AS Player, g.GW_number AS GW, r.total_points AS Points
         ORDER BY Points DESC
         LIMIT 1
     """
-}
\ No newline at end of file
+}
+
+# Normalize indentation/whitespace once at import time. Neo4j keys its query-
+# plan cache on the literal query text, so every caller must send byte-
+# identical strings for the same template to hit the cached plan.
+import textwrap
+
+CYPHER_TEMPLATES = {
+    name: textwrap.dedent(query).strip()
+    for name, query in CYPHER_TEMPLATES.items()
+}
@@ -1,21 +1,26 @@
 """
 Library of Cypher Query Templates for the FPL Agent.
 UPDATED: explicit 'Subject' aliases AND 'Position' context to prevent LLM confusion.
+
+Templates assume the indexes created by graph_setup (name_lower TEXT indexes
+plus the migrations under src/migrations/) exist; run graph_setup.py once
+after loading data.
 """
 
 CYPHER_TEMPLATES = {
     "player_summary": """
         MATCH (p:Player)-[r:PLAYED_IN]->(f:Fixture {season: $season})
-        WHERE toLower(p.player_name) CONTAINS toLower($player_name)
+        WHERE p.player_name_lower CONTAINS $player_name
         RETURN p.player_name AS Player,
                sum(r.total_points) AS TotalPoints,
                sum(r.goals_scored) AS Goals,
                sum(r.assists) AS Assists,
                sum(r.minutes) AS Minutes
+        LIMIT toInteger($limit)
     """,
     "top_players_by_position": """
         MATCH (p:Player)-[:PLAYS_AS]->(pos:Position)
-        WHERE toLower(pos.name) = toLower($position) OR toLower(pos.name) = toLower($position_mapped)
+        WHERE pos.name_lower = $position OR pos.name_lower = $position_mapped
         MATCH (p)-[r:PLAYED_IN]->(f:Fixture {season: $season})
         WITH p, pos, sum(coalesce(r.total_points, 0)) AS TotalPoints
         ORDER BY TotalPoints DESC
@@ -24,21 +29,21 @@ CYPHER_TEMPLATES = {
     """,
     "player_vs_team": """
         MATCH (p:Player)-[r:PLAYED_IN]->(f:Fixture {season: $season})
-        WHERE toLower(p.player_name) CONTAINS toLower($player_name)
+        WHERE p.player_name_lower CONTAINS $player_name
         MATCH (f)-[:HAS_HOME_TEAM|HAS_AWAY_TEAM]->(t:Team)
-        WHERE toLower(t.name) CONTAINS toLower($opponent)
+        WHERE t.name_lower CONTAINS $opponent
         RETURN p.player_name AS Player,
                f.fixture_number AS GW,
                t.name AS Opponent,
                r.total_points AS Points,
                r.goals_scored AS Goals
+        LIMIT toInteger($limit)
     """,
     "team_squad_by_position": """
-            MATCH (t:Team) WHERE toLower(t.name) CONTAINS toLower($team)
-            MATCH (p:Player)-[:PLAYS_AS]->(pos:Position)
-            WHERE toLower(pos.name) = toLower($position) OR toLower(pos.name) = toLower($position_mapped)
-            MATCH (p)-[r:PLAYED_IN]->(f:Fixture {season: $season})
-            MATCH (f)-[:HAS_HOME_TEAM|HAS_AWAY_TEAM]->(t)
+            MATCH (t:Team)<-[:HAS_HOME_TEAM|HAS_AWAY_TEAM]-(f:Fixture {season: $season})
+                  <-[r:PLAYED_IN]-(p:Player)-[:PLAYS_AS]->(pos:Position)
+            WHERE t.name_lower CONTAINS $team
+              AND (pos.name_lower = $position OR pos.name_lower = $position_mapped)
             WITH p, pos, t, sum(r.total_points) as TotalPoints
             ORDER BY TotalPoints DESC
             RETURN t.name AS Team, p.player_name AS Player, pos.name AS Position, TotalPoints
@@ -46,30 +51,30 @@ CYPHER_TEMPLATES = {
         """,
     "compare_players": """
         MATCH (p:Player)-[r:PLAYED_IN]->(f:Fixture {season: $season})
-        WHERE any(name IN $player_names WHERE toLower(p.player_name) CONTAINS toLower(name))
+        WHERE any(name IN $player_names WHERE p.player_name_lower CONTAINS name)
         RETURN p.player_name AS Player,
                sum(r.total_points) AS TotalPoints,
                sum(r.goals_scored) AS Goals,
                sum(r.assists) AS Assists
+        LIMIT toInteger($limit)
     """,
     "team_performance_in_gw": """
         MATCH (s:Season {season_name: $season})-[:HAS_GW]->(g:Gameweek {GW_number: toInteger($gw)})
         MATCH (g)-[:HAS_FIXTURE]->(f:Fixture)
         MATCH (t:Team)<-[:HAS_HOME_TEAM|HAS_AWAY_TEAM]-(f)
-        WHERE toLower(t.name) CONTAINS toLower($team)
+        WHERE t.name_lower CONTAINS $team
         MATCH (f)-[:HAS_HOME_TEAM|HAS_AWAY_TEAM]->(opponent:Team)
         WHERE opponent.name <> t.name
         MATCH (p:Player)-[r:PLAYED_IN]->(f)
-        MATCH (p)-[:PLAYED_IN]->(f_all:Fixture {season: $season})
-        MATCH (f_all)-[:HAS_HOME_TEAM|HAS_AWAY_TEAM]->(t)
-        WITH g, t, opponent, p, r, count(f_all) as squad_games
-        WHERE squad_games > 2
+        // Precomputed by graph_setup.ensure_squad_relationships; replaces a
+        // full re-scan of each player's season just to filter squad members.
+        MATCH (p)-[:SQUAD_OF {season: $season}]->(t)
         WITH g, t, opponent, sum(r.goals_scored) as TeamGoals, sum(r.total_points) as TeamPoints, collect(p.player_name)[0..3] as KeyPlayers
         RETURN t.name AS Team, g.GW_number AS GW, opponent.name AS Opponent, TeamGoals, TeamPoints, KeyPlayers
     """,
     "recommend_differentials": """
         MATCH (p:Player)-[:PLAYS_AS]->(pos:Position)
-        WHERE toLower(pos.name) = toLower($position) OR toLower(pos.name) = toLower($position_mapped)
+        WHERE pos.name_lower = $position OR pos.name_lower = $position_mapped
         MATCH (p)-[r:PLAYED_IN]->(f:Fixture {season: $season})
         WITH p, pos, avg(r.influence) as AvgInf, sum(r.total_points) as Points
         WHERE Points > 30 
@@ -78,9 +83,13 @@ CYPHER_TEMPLATES = {
         LIMIT toInteger($limit)
     """,
     "best_captain_options": """
-        MATCH (p:Player)-[r:PLAYED_IN]->(f:Fixture {season: $season})
-        WITH p, r ORDER BY f.fixture_number DESC
-        WITH p, collect(r.total_points)[0..3] as last_3_games
+        MATCH (p:Player)
+        CALL {
+            WITH p
+            MATCH (p)-[r:PLAYED_IN]->(f:Fixture {season: $season})
+            RETURN r.total_points AS pts ORDER BY f.fixture_number DESC LIMIT 3
+        }
+        WITH p, collect(pts) as last_3_games
         WITH p, reduce(s = 0, x IN last_3_games | s + x) as form_points
         ORDER BY form_points DESC
         LIMIT 5
@@ -88,16 +97,26 @@ CYPHER_TEMPLATES = {
     """,
     "player_availability_check": """
         MATCH (p:Player)-[r:PLAYED_IN]->(f:Fixture {season: $season})
-        WHERE toLower(p.player_name) CONTAINS toLower($player_name)
+        WHERE p.player_name_lower CONTAINS $player_name
         WITH p, r, f ORDER BY f.fixture_number DESC LIMIT 3
         RETURN p.player_name AS Player, collect(r.minutes) as Last3Minutes
+        LIMIT toInteger($limit)
     """,
     "highest_scoring_gw": """
-        MATCH (p:Player)-[r:PLAYED_IN]->(f:Fixture {season: $season})
-        WHERE toLower(p.player_name) CONTAINS toLower($player_name)
-        MATCH (s:Season)-[:HAS_GW]->(g:Gameweek)-[:HAS_FIXTURE]->(f)
+        MATCH (p:Player)-[r:PLAYED_IN]->(f:Fixture {season: $season})<-[:HAS_FIXTURE]-(g:Gameweek)
+        WHERE p.player_name_lower CONTAINS $player_name
         RETURN p.player_name AS Player, g.GW_number AS GW, r.total_points AS Points
         ORDER BY Points DESC
         LIMIT 1
     """
-}
\ No newline at end of file
+}
+
+# Normalize indentation/whitespace once at import time. Neo4j keys its query-
+# plan cache on the literal query text, so every caller must send byte-
+# identical strings for the same template to hit the cached plan.
+import textwrap
+
+CYPHER_TEMPLATES = {
+    name: textwrap.dedent(query).strip()
+    for name, query in CYPHER_TEMPLATES.items()
+}
@@ -1,5 +1,8 @@
+import csv
 import time
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from fpl_agent_baseline import parse_user_intents_batch
 from fpl_agent_hybrid import process_query
 
 # 1. Define your "Golden Set" of Test Cases [cite: 83]
@@ -16,55 +19,94 @@ TEST_CASES = [
 # Ensure these keys match what is in your llm_utils.py
 MODELS = ["gemma", "llama", "gemini"] 
 
+def _run_one(model, query, intent_data=None):
+    """Run a single (model, query) test case and return its result row."""
+    # A. Quantitative Metric: Response Time
+    start_time = time.perf_counter()
+
+    try:
+        # Force Hybrid Mode (Cypher + Vector) for a fair test
+        response_data = process_query(
+            query,
+            llm_key=model,
+            emb_key="minilm",  # Keep embedding constant to isolate LLM performance
+            use_cypher=True,
+            use_vector=True,
+            intent_data=intent_data
+        )
+        answer = response_data["answer"]
+        error = "None"
+    except Exception as e:
+        answer = "ERROR"
+        error = str(e)
+
+    duration = round(time.perf_counter() - start_time, 2)
+
+    return {
+        "Model": model,
+        "Question": query,
+        "Response Time (s)": duration,
+        "Answer Length (chars)": len(answer),
+        "Final Answer": answer,
+        "Error": error,
+        # Placeholders for Manual Grading
+        "Qualitative: Accuracy (1-5)": "",
+        "Qualitative: Naturalness (1-5)": ""
+    }
+
+
 def run_evaluation():
-    results = []
     print(f" Starting Evaluation on {len(MODELS)} models with {len(TEST_CASES)} test cases...\n")
 
+    # Each test case is dominated by network wait (LLM APIs + Neo4j), so the
+    # cases run concurrently; wall time drops to roughly the slowest bucket.
+    # Classify all test cases with one LLM call up front; the routing model is
+    # fixed (gemini_flash), so the same intents apply to every tested LLM.
+    print("Classifying test-case intents in one batch call...")
+    intents = dict(zip(TEST_CASES, parse_user_intents_batch(TEST_CASES)))
+
+    # Untimed warmup: the first call per model pays one-time costs (embedding
+    # model load, TLS pool setup, first-token latency) that would otherwise
+    # inflate whichever test case happens to run first. One throwaway query
+    # per model moves that out of the timed rows.
+    print("Warming up models (untimed)...")
     for model in MODELS:
-        print(f"--- Testing Model: {model.upper()} ---")
-        
-        for query in TEST_CASES:
-            print(f" Q: {query}")
-            
-            # A. Quantitative Metric: Response Time 
-            start_time = time.time()
-            
-            try:
-                # Force Hybrid Mode (Cypher + Vector) for a fair test
-                response_data = process_query(
-                    query, 
-                    llm_key=model, 
-                    emb_key="minilm",  # Keep embedding constant to isolate LLM performance
-                    use_cypher=True, 
-                    use_vector=True
-                )
-                answer = response_data["answer"]
-                error = "None"
-            except Exception as e:
-                answer = "ERROR"
-                error = str(e)
-                
-            end_time = time.time()
-            duration = round(end_time - start_time, 2)
-            
-            # Store Result
-            results.append({
-                "Model": model,
-                "Question": query,
-                "Response Time (s)": duration,
-                "Answer Length (chars)": len(answer),
-                "Final Answer": answer,
-                "Error": error,
-                # Placeholders for Manual Grading 
-                "Qualitative: Accuracy (1-5)": "", 
-                "Qualitative: Naturalness (1-5)": ""
-            })
-            print(f"Done in {duration}s")
-
-    # 3. Save to CSV for analysis
-    df = pd.DataFrame(results)
+        try:
+            process_query(
+                "warmup", llm_key=model, emb_key="minilm",
+                use_cypher=False, use_vector=True,
+                intent_data={"intent": "error", "parameters": {}}
+            )
+        except Exception as e:
+            print(f"Warmup warning for {model}: {e}")
+
+    tasks = [(model, query) for model in MODELS for query in TEST_CASES]
+
+    # 3. Stream rows to CSV as they finish. A crash mid-run keeps everything
+    # completed so far, and memory stays bounded however large the golden set
+    # grows. Rows land in completion order; the Model/Question columns carry
+    # the grouping, so sort in Excel/Sheets if a fixed order is wanted.
+    fieldnames = [
+        "Model", "Question", "Response Time (s)", "Answer Length (chars)",
+        "Final Answer", "Error",
+        "Qualitative: Accuracy (1-5)", "Qualitative: Naturalness (1-5)",
+    ]
     output_file = "model_evaluation_results.csv"
-    df.to_csv(output_file, index=False)
+
+    with open(output_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+
+        with ThreadPoolExecutor(max_workers=min(len(tasks), 12)) as ex:
+            futures = {ex.submit(_run_one, model, query, intents[query]): (model, query)
+                       for model, query in tasks}
+            for future in as_completed(futures):
+                model, query = futures[future]
+                row = future.result()
+                writer.writerow(row)
+                f.flush()
+                print(f"[{model}] {query} -> done in {row['Response Time (s)']}s")
+
     print(f"\nEvaluation Complete! Results saved to '{output_file}'.")
     print(" Open this CSV in Excel/Sheets to perform your Qualitative Grading.")
 
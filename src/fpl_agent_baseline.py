@@ -1,20 +1,124 @@
+import atexit
+import functools
 import json
 import re
+from itertools import islice
 from typing import Dict, Any, List
-from neo4j import GraphDatabase
+from neo4j import GraphDatabase, RoutingControl
 from config import NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD, DEFAULT_SEASON
 from llm_utils import get_llm_instance
 from cypher_template_2 import CYPHER_TEMPLATES
 
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# --- SHARED NEO4J DRIVER ---
+# Driver construction performs the TLS + auth handshake and builds a whole
+# connection pool; recreating it per query dominated run_cypher's latency.
+_DRIVER = None
+
+
+def _get_driver():
+    """Return the lazily-created module-level Neo4j driver."""
+    global _DRIVER
+    if _DRIVER is None:
+        _DRIVER = GraphDatabase.driver(
+            NEO4J_URI,
+            auth=(NEO4J_USER, NEO4J_PASSWORD),
+            max_connection_pool_size=32,
+        )
+        atexit.register(_DRIVER.close)
+        # One-shot: make sure the schema the templates depend on exists
+        # (all steps are idempotent SET/MERGE/IF NOT EXISTS). The lowered
+        # name properties and SQUAD_OF edges are load-bearing, not just an
+        # optimization -- against a database that never ran graph_setup.py,
+        # null CONTAINS $x is null and every template silently returns [].
+        # Failure is non-fatal so an offline DB still surfaces its own error.
+        try:
+            from graph_setup import (
+                ensure_indexes,
+                ensure_name_normalization,
+                ensure_squad_relationships,
+            )
+            ensure_name_normalization(_DRIVER)
+            ensure_squad_relationships(_DRIVER)
+            ensure_indexes(_DRIVER)
+        except Exception as e:
+            print(f"Graph Setup Warning: {e}")
+    return _DRIVER
+
+# --- HOT-PATH CONSTANTS ---
+# Built once at import; normalize_params/clean_json_string run on every query
+# and should not rebuild dicts or recompile regexes per call.
+_CODEBLOCK_RE = re.compile(r"```json|```")
+
+_POS_MAP = {
+    "gkp": "GKP", "goalie": "GKP", "goalkeeper": "GKP", "gk": "GKP",
+    "def": "DEF", "defender": "DEF", "defence": "DEF",
+    "mid": "MID", "midfielder": "MID", "midfield": "MID",
+    "fwd": "FWD", "forward": "FWD", "striker": "FWD", "attack": "FWD"
+}
+
+_KEY_MAPPINGS = {
+    "player": "player_name",
+    "name": "player_name",
+    "home_team": "team",
+    "away_team": "opponent"
+}
+
+# Copied as the starting dict for every normalize_params call; treat as
+# frozen. 'position_mapped' must exist so templates never see a missing key.
+_DEFAULTS = {
+    "season": DEFAULT_SEASON,
+    "limit": 5,
+    "player_name": "",
+    "opponent": "",
+    "team": "",
+    "player_names": [],
+    "position": "",
+    "position_mapped": ""
+}
+
+_TEAM_MAP = {
+    "manchester city": "Man City",
+    "manchester united": "Man Utd",
+    "man utd": "Man Utd",
+    "nottingham": "Nott'm Forest",
+    "tottenham": "Spurs",
+    "wolves": "Wolves",
+    "sheffield": "Sheffield Utd",
+    "luton": "Luton",
+    "newcastle": "Newcastle"
+}
+
+# With pyahocorasick installed, all team aliases are matched in one DFA pass
+# over the value instead of one substring scan per alias.
+if ahocorasick:
+    _TEAM_AUTOMATON = ahocorasick.Automaton()
+    for _long_name, _short_name in _TEAM_MAP.items():
+        _TEAM_AUTOMATON.add_word(_long_name, _short_name)
+    _TEAM_AUTOMATON.make_automaton()
+else:
+    _TEAM_AUTOMATON = None
+
+
+def _map_team_name(val: str):
+    """Return the canonical short team name mentioned in `val`, or None."""
+    if _TEAM_AUTOMATON is not None:
+        for _, short_name in _TEAM_AUTOMATON.iter(val):
+            return short_name
+        return None
+    for long_name, short_name in _TEAM_MAP.items():
+        if long_name in val:
+            return short_name
+    return None
+
 # --- 1. INTENT CLASSIFICATION (Updated for Scout/ICT Logic) ---
-def parse_user_intent(query: str) -> Dict[str, Any]:
-    """
-    Uses an LLM to map natural language to a Cypher template key + parameters.
-    """
-    llm = get_llm_instance("gemini_flash") # Fast model for routing
-    
-    # Updated System Prompt to match your new "Scout-Heavy" templates
-    system_instruction = """
+# System Prompt matching the "Scout-Heavy" templates; shared by the single
+# and batch classifiers.
+INTENT_SYSTEM_PROMPT = """
     You are an intent classifier for an FPL AI Assistant.
     Map the user's query to one of the following INTENTS and extract parameters.
     
@@ -52,23 +156,68 @@ def parse_user_intent(query: str) -> Dict[str, Any]:
       }
     }
     """
-    
-    prompt = f"{system_instruction}\n\nUser Query: {query}\nJSON:"
-    
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_user_intent_cached(query: str, model_key: str) -> str:
+    """LLM round-trip for intent classification, memoized on (query, model).
+
+    Returns the raw response text; callers re-parse it so cache hits hand out
+    fresh dicts that are safe to mutate downstream.
+    """
+    llm = get_llm_instance(model_key)
+    prompt = f"{INTENT_SYSTEM_PROMPT}\n\nUser Query: {query}\nJSON:"
+    response = llm.invoke(prompt)
+    # Handle cases where LLM returns object vs string
+    return response.content if hasattr(response, 'content') else str(response)
+
+
+def parse_user_intent(query: str) -> Dict[str, Any]:
+    """
+    Uses an LLM to map natural language to a Cypher template key + parameters.
+    Repeated queries hit the LRU cache and skip the LLM entirely.
+    """
     try:
-        response = llm.invoke(prompt)
-        # Handle cases where LLM returns object vs string
-        content = response.content if hasattr(response, 'content') else str(response)
+        content = _parse_user_intent_cached(query, "gemini_flash") # Fast model for routing
         return clean_json_string(content)
     except Exception as e:
         print(f"Intent Parsing Error: {e}")
         return {"intent": "error", "parameters": {}}
 
+
+def parse_user_intents_batch(queries: List[str]) -> List[Dict[str, Any]]:
+    """
+    Classify several queries with ONE LLM call, amortizing the long system
+    prompt across them. Returns one intent dict per query, in order; falls
+    back to per-query parsing if the batched output cannot be used.
+    """
+    llm = get_llm_instance("gemini_flash")
+
+    numbered = "\n".join(f"{i + 1}) {q}" for i, q in enumerate(queries))
+    prompt = (
+        f"{INTENT_SYSTEM_PROMPT}\n\n"
+        "Classify EACH of the following queries. Return ONLY a JSON array "
+        "with one object (in the OUTPUT FORMAT above) per query, in the same "
+        f"order.\n\nQueries:\n{numbered}\nJSON array:"
+    )
+
+    try:
+        response = llm.invoke(prompt)
+        content = response.content if hasattr(response, 'content') else str(response)
+        parsed = json.loads(_CODEBLOCK_RE.sub("", content).strip())
+        if isinstance(parsed, list) and len(parsed) == len(queries):
+            return parsed
+        print(f"Batch Intent Warning: expected {len(queries)} items, got {parsed!r:.80}")
+    except Exception as e:
+        print(f"Batch Intent Parsing Error: {e}")
+
+    return [parse_user_intent(query) for query in queries]
+
 def clean_json_string(json_str: str) -> Dict[str, Any]:
     """Helper to sanitize LLM JSON output."""
     try:
         # Remove markdown code blocks if present
-        clean = re.sub(r"```json|```", "", json_str).strip()
+        clean = _CODEBLOCK_RE.sub("", json_str).strip()
         return json.loads(clean)
     except json.JSONDecodeError:
         return {"intent": "error", "parameters": {}}
@@ -79,35 +228,13 @@ def normalize_params(params: Dict[str, Any]) -> Dict[str, Any]:
     Ensure parameters match DB format.
     Handles key aliasing, type conversion, and entity mapping (Position/Teams).
     """
-    if not params:
-        params = {}
-
-    # 1. Parameter Key Normalization
-    key_mappings = {
-        "player": "player_name",
-        "name": "player_name",
-        "home_team": "team",
-        "away_team": "opponent"
-    }
-    
-    cleaned_input = {}
-    for k, v in params.items():
-        new_key = key_mappings.get(k, k)
-        cleaned_input[new_key] = v
-
-    # 2. Define Defaults (Include 'position_mapped' to fix the crash)
-    defaults = {
-        "season": DEFAULT_SEASON,
-        "limit": 5,
-        "player_name": "",
-        "opponent": "",
-        "team": "",
-        "player_names": [],
-        "position": "",
-        "position_mapped": ""  # <--- CRITICAL FIX: Ensure key exists
-    }
-    
-    final_params = {**defaults, **cleaned_input}
+    # 1 + 2. Defaults and Key Normalization in one pass: start from a copy
+    # of the module-level defaults and overlay the (alias-resolved) input.
+    # No intermediate cleaned_input dict, no per-call literal rebuilds.
+    final_params = _DEFAULTS.copy()
+    if params:
+        for k, v in params.items():
+            final_params[_KEY_MAPPINGS.get(k, k)] = v
 
     # 3. Type Enforcement
     try:
@@ -122,15 +249,8 @@ def normalize_params(params: Dict[str, Any]) -> Dict[str, Any]:
             pass
 
     # 4. Position Mapping (Normalize to DB codes)
-    pos_map = {
-        "gkp": "GKP", "goalie": "GKP", "goalkeeper": "GKP", "gk": "GKP",
-        "def": "DEF", "defender": "DEF", "defence": "DEF",
-        "mid": "MID", "midfielder": "MID", "midfield": "MID",
-        "fwd": "FWD", "forward": "FWD", "striker": "FWD", "attack": "FWD"
-    }
-    
     raw_pos = str(final_params.get("position", "")).lower()
-    mapped_pos = pos_map.get(raw_pos)
+    mapped_pos = _POS_MAP.get(raw_pos)
     
     # If we found a valid mapping (e.g., "defender" -> "DEF")
     if mapped_pos:
@@ -144,30 +264,25 @@ def normalize_params(params: Dict[str, Any]) -> Dict[str, Any]:
         final_params["position_mapped"] = raw_pos if raw_pos else ""
 
     # 5. Team Name Mapping
-    team_map = {
-        "manchester city": "Man City",
-        "manchester united": "Man Utd",
-        "man utd": "Man Utd",
-        "nottingham": "Nott'm Forest",
-        "tottenham": "Spurs",
-        "wolves": "Wolves",
-        "sheffield": "Sheffield Utd",
-        "luton": "Luton",
-        "newcastle": "Newcastle"
-    }
-    
     for key in ["team", "opponent"]:
         val = str(final_params.get(key, "")).lower()
         if val:
-            for long_name, short_name in team_map.items():
-                if long_name in val:
-                    final_params[key] = short_name
-                    break
+            short_name = _map_team_name(val)
+            if short_name:
+                final_params[key] = short_name
 
     # 6. List Logic
     if not final_params["player_names"] and final_params["player_name"]:
         final_params["player_names"] = [final_params["player_name"]]
 
+    # 7. Case Folding (once, client-side)
+    # Templates compare against the precomputed *_lower node properties, so
+    # parameters are lowercased here instead of wrapping every one in
+    # toLower() inside the query text.
+    for key in ("player_name", "team", "opponent", "position", "position_mapped"):
+        final_params[key] = str(final_params.get(key, "")).lower()
+    final_params["player_names"] = [str(n).lower() for n in final_params["player_names"]]
+
     return final_params
 
 # --- 3. EXECUTION LAYER (Returns Raw Data now) ---
@@ -185,22 +300,37 @@ def run_cypher(intent: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
     safe_params = normalize_params(params)
     
     results = []
-    driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
-    
     try:
-        with driver.session() as session:
-            result = session.run(query_template, safe_params)
-            # Convert Neo4j records to standard Python dicts
-            results = [dict(record) for record in result]
-            limit = safe_params.get("limit", 5)
-            if len(results) > limit:
-                # print(f"[Info] Truncating results from {len(results)} to {limit}")
-                results = results[:limit]
+        # execute_query reuses the driver's internal pool (no per-call session
+        # object) and adds managed retries/routing. Templates are sent as the
+        # byte-identical module-level strings, so the server's plan cache hits
+        # on every call after the first.
+        # The transformer builds row dicts while the result stream is being
+        # drained, instead of materializing Record objects first and
+        # re-walking them here. Rows stay dicts (not tuples) on purpose:
+        # format_context and the UI's DataFrame both consume mappings.
+        # Every template carries LIMIT toInteger($limit) (or a fixed LIMIT),
+        # so truncation normally happens server-side; islice is the
+        # belt-and-braces bound for any future template that forgets one --
+        # it stops pulling Bolt records at `limit` instead of draining the
+        # stream and slicing afterwards.
+        limit = safe_params["limit"]
+
+        def _rows(result):
+            return [record.data() for record in islice(result, limit)]
+
+        # All templates are read-only; declaring that lets the driver route
+        # to read replicas in a cluster and use read transactions.
+        results = _get_driver().execute_query(
+            query_template,
+            parameters_=safe_params,
+            database_="neo4j",
+            routing_=RoutingControl.READ,
+            result_transformer_=_rows,
+        )
     except Exception as e:
         print(f"Cypher Execution Error: {e}")
-    finally:
-        driver.close()
-        
+
     return results
 
 if __name__ == "__main__":
@@ -0,0 +1,105 @@
+"""
+One-time graph maintenance for the FPL Agent.
+
+The Cypher templates match names case-insensitively. Doing that with
+`toLower(p.player_name) CONTAINS ...` lowercases every row at query time and
+defeats index use, so we precompute lowercased copies of the hot name
+properties once and index them. Run `python graph_setup.py` (or call
+`prepare_graph`) after any data reload.
+"""
+
+import os
+
+from neo4j import GraphDatabase
+
+from config import NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+
+# Lowercased shadow properties for every name the templates filter on.
+NORMALIZE_STATEMENTS = [
+    "MATCH (p:Player) SET p.player_name_lower = toLower(p.player_name)",
+    "MATCH (t:Team) SET t.name_lower = toLower(t.name)",
+    "MATCH (pos:Position) SET pos.name_lower = toLower(pos.name)",
+]
+
+# TEXT indexes back the CONTAINS / equality predicates on those properties.
+# (A Lucene full-text index was considered but its tokenizer does not match
+# the arbitrary-substring semantics the templates rely on.)
+INDEX_STATEMENTS = [
+    "CREATE TEXT INDEX player_name_lower_idx IF NOT EXISTS "
+    "FOR (p:Player) ON (p.player_name_lower)",
+    "CREATE TEXT INDEX team_name_lower_idx IF NOT EXISTS "
+    "FOR (t:Team) ON (t.name_lower)",
+    "CREATE TEXT INDEX position_name_lower_idx IF NOT EXISTS "
+    "FOR (pos:Position) ON (pos.name_lower)",
+]
+
+
+def ensure_name_normalization(driver):
+    """Populate the lowercased name properties used by the query templates."""
+    with driver.session() as session:
+        for statement in NORMALIZE_STATEMENTS:
+            session.run(statement).consume()
+
+
+# Squad membership (played >2 fixtures for the team in a season) is derivable
+# from PLAYED_IN, but deriving it inside per-gameweek queries re-scans every
+# player's whole season. Materialize it once instead.
+SQUAD_OF_STATEMENT = """
+    MATCH (p:Player)-[r:PLAYED_IN]->(f:Fixture)
+    MATCH (f)-[:HAS_HOME_TEAM|HAS_AWAY_TEAM]->(t:Team)
+    WITH p, t, f.season AS season, count(f) AS games
+    WHERE games > 2
+    MERGE (p)-[:SQUAD_OF {season: season}]->(t)
+"""
+
+
+def ensure_squad_relationships(driver):
+    """Materialize (Player)-[:SQUAD_OF {season}]->(Team) membership edges."""
+    with driver.session() as session:
+        session.run(SQUAD_OF_STATEMENT).consume()
+
+
+def ensure_indexes(driver):
+    """Create the indexes backing the templates' name predicates."""
+    with driver.session() as session:
+        for statement in INDEX_STATEMENTS:
+            session.run(statement).consume()
+
+
+def run_migrations(driver):
+    """Apply every .cypher file under migrations/ in name order.
+
+    Files hold semicolon-separated statements (comments allowed); all
+    statements are idempotent (IF NOT EXISTS / MERGE), so re-running is safe.
+    """
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        if not filename.endswith(".cypher"):
+            continue
+        with open(os.path.join(MIGRATIONS_DIR, filename)) as fh:
+            statements = [stmt.strip() for stmt in fh.read().split(";") if stmt.strip()]
+        with driver.session() as session:
+            for statement in statements:
+                session.execute_write(lambda tx, s=statement: tx.run(s).consume())
+        print(f"Applied migration {filename}")
+
+
+def prepare_graph(driver=None):
+    """Run all maintenance steps; opens a throwaway driver if none is given."""
+    own_driver = driver is None
+    if own_driver:
+        driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+    try:
+        ensure_name_normalization(driver)
+        ensure_squad_relationships(driver)
+        ensure_indexes(driver)
+        run_migrations(driver)
+        print("Graph normalization + indexes are up to date.")
+    finally:
+        if own_driver:
+            driver.close()
+
+
+if __name__ == "__main__":
+    prepare_graph()
@@ -1,47 +1,46 @@
 import os
-from typing import Any, List, Optional
+from typing import Any, Iterator, List, Optional
 from langchain_core.language_models.llms import LLM
-from huggingface_hub import InferenceClient
-from config import HF_TOKEN, GEMINI_API_KEY
+from langchain_core.outputs import GenerationChunk
+from huggingface_hub import AsyncInferenceClient, InferenceClient
+# LLM_CONFIGS is re-exported here for existing importers; it lives in
+# config.py so the UI can read it without pulling in langchain/hf_hub.
+from config import HF_TOKEN, GEMINI_API_KEY, LLM_CONFIGS
 
 try:
     from langchain_google_genai import ChatGoogleGenerativeAI
 except ImportError:
     ChatGoogleGenerativeAI = None
 
-# --- CONFIGURATION ---
-LLM_CONFIGS = {
-    "gemma": {
-        "type": "hf", 
-        "repo_id": "google/gemma-2-2b-it", 
-        "description": "Gemma 2B (Fast)"
-    },
-    "llama": {
-        "type": "hf", 
-        "repo_id": "meta-llama/Llama-3.1-8B-Instruct", 
-        "description": "Llama 3 8B (Smart)"
-    },
-    "gemini": {
-        "type": "google", 
-        "repo_id": "gemini-2.5-pro", 
-        "description": "Gemini 2.5 pro"
-    },
-        "gemini_flash": {
-        "type": "google", 
-        "repo_id": "gemini-2.5-flash", 
-        "description": "Gemini 2.5 Flash"
-    },
-}
+# Shared HTTP clients, one (sync, async) pair per repo_id. InferenceClient
+# keeps its TLS session alive between calls, so every FreeHFChatLLM built
+# for the same model reuses the warm connection instead of re-handshaking.
+_HF_CLIENTS = {}
+
+
+def _get_hf_clients(repo_id, token):
+    clients = _HF_CLIENTS.get(repo_id)
+    if clients is None:
+        # An unset token arrives as "" (config.HF_TOKEN is env-sourced);
+        # pass None so the client falls back to anonymous/local auth.
+        clients = (
+            InferenceClient(model=repo_id, token=token or None),
+            AsyncInferenceClient(model=repo_id, token=token or None),
+        )
+        _HF_CLIENTS[repo_id] = clients
+    return clients
+
 
 class FreeHFChatLLM(LLM):
     """Wrapper for Hugging Face Inference API."""
     repo_id: str
     api_token: str = os.environ.get("HUGGINGFACEHUB_API_TOKEN", HF_TOKEN)
     client: Any = None
+    async_client: Any = None
 
     def __init__(self, repo_id: str, **kwargs):
         super().__init__(repo_id=repo_id, **kwargs)
-        self.client = InferenceClient(model=self.repo_id, token=self.api_token)
+        self.client, self.async_client = _get_hf_clients(self.repo_id, self.api_token)
 
     @property
     def _llm_type(self) -> str:
@@ -52,26 +51,73 @@ class FreeHFChatLLM(LLM):
             # Gemma/Llama expect chat-formatted messages
             messages = [{"role": "user", "content": prompt}]
             response = self.client.chat_completion(
-                messages, 
-                max_tokens=500, 
+                messages,
+                max_tokens=500,
                 temperature=0.0
             )
             return response.choices[0].message.content
         except Exception as e:
             return f"Error from Hugging Face API: {e}"
 
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[GenerationChunk]:
+        """Token streaming for LLM.stream(): the first token arrives after
+        roughly one network round trip instead of after the full generation."""
+        messages = [{"role": "user", "content": prompt}]
+        try:
+            for chunk in self.client.chat_completion(
+                messages,
+                max_tokens=500,
+                temperature=0.0,
+                stream=True
+            ):
+                token = chunk.choices[0].delta.content or ""
+                if token:
+                    if run_manager:
+                        run_manager.on_llm_new_token(token)
+                    yield GenerationChunk(text=token)
+        except Exception as e:
+            yield GenerationChunk(text=f"Error from Hugging Face API: {e}")
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        """Async variant of _call; lets ainvoke/abatch overlap the HTTP round
+        trips of several prompts instead of waiting on each in turn."""
+        try:
+            messages = [{"role": "user", "content": prompt}]
+            response = await self.async_client.chat_completion(
+                messages,
+                max_tokens=500,
+                temperature=0.0
+            )
+            return response.choices[0].message.content
+        except Exception as e:
+            return f"Error from Hugging Face API: {e}"
+
+# One LLM wrapper per config key. process_query asks for an instance on
+# every request, and construction (pydantic validation, client setup) is
+# not free; the wrappers are stateless between calls, so sharing is safe.
+_LLM_CACHE = {}
+
+
 def get_llm_instance(llm_key):
-    """Factory function to return the requested LLM object."""
+    """Factory function to return the requested LLM object (pooled per key)."""
     if llm_key not in LLM_CONFIGS:
         raise ValueError(f"Unknown LLM key: {llm_key}")
-        
+
+    llm = _LLM_CACHE.get(llm_key)
+    if llm is not None:
+        return llm
+
     config = LLM_CONFIGS[llm_key]
-    
+
     if config["type"] == "google":
         if not ChatGoogleGenerativeAI:
             return None # Handle missing library gracefully in UI
         os.environ["GOOGLE_API_KEY"] = GEMINI_API_KEY
-        return ChatGoogleGenerativeAI(model=config["repo_id"], temperature=0.0)
-    
+        llm = ChatGoogleGenerativeAI(model=config["repo_id"], temperature=0.0)
+
     else: # Hugging Face
-        return FreeHFChatLLM(repo_id=config["repo_id"])
\ No newline at end of file
+        llm = FreeHFChatLLM(repo_id=config["repo_id"])
+
+    _LLM_CACHE[llm_key] = llm
+    return llm
\ No newline at end of file
@@ -0,0 +1,8 @@
+// Indexes assumed by the templates in cypher_templates.py / cypher_template_2.py.
+// Nearly every template filters Fixture by season and orders by fixture_number;
+// without the composite index these run as label scans + property filters.
+CREATE RANGE INDEX fixture_season_number IF NOT EXISTS
+FOR (f:Fixture) ON (f.season, f.fixture_number);
+
+CREATE INDEX played_in_points IF NOT EXISTS
+FOR ()-[r:PLAYED_IN]-() ON (r.total_points);
@@ -0,0 +1,59 @@
+"""
+Small vector-math kernels for client-side scoring (proximity cache, reranking).
+
+With numba installed, cosine_scores compiles to a fused, parallel SIMD kernel
+(cached on disk after the first run) that normalizes and dots in one pass over
+the candidate matrix. Without numba, a vectorized NumPy fallback with
+identical semantics is used. Kernels expect float32, C-contiguous inputs --
+pass matrices through np.ascontiguousarray once at cache-build time.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
+
+
+def _cosine_scores_jit(q, C):
+    out = np.empty(C.shape[0], dtype=np.float32)
+    q_sq = np.float32(0.0)
+    for j in range(q.shape[0]):
+        q_sq += q[j] * q[j]
+    q_norm = np.sqrt(q_sq)
+    if q_norm == 0.0:
+        q_norm = np.float32(1.0)
+    for i in prange(C.shape[0]):
+        dot = np.float32(0.0)
+        row_sq = np.float32(0.0)
+        for j in range(C.shape[1]):
+            dot += C[i, j] * q[j]
+            row_sq += C[i, j] * C[i, j]
+        row_norm = np.sqrt(row_sq)
+        if row_norm == 0.0:
+            row_norm = np.float32(1.0)
+        out[i] = dot / (q_norm * row_norm)
+    return out
+
+
+def _cosine_scores_numpy(q, C):
+    q_norm = np.linalg.norm(q)
+    if q_norm == 0.0:
+        q_norm = 1.0
+    row_norms = np.linalg.norm(C, axis=1)
+    row_norms[row_norms == 0.0] = 1.0
+    return (C @ q) / (row_norms * q_norm)
+
+
+if njit is not None:
+    cosine_scores = njit(cache=True, parallel=True, fastmath=True)(_cosine_scores_jit)
+else:
+    cosine_scores = _cosine_scores_numpy
+
+cosine_scores.__doc__ = """Cosine similarity of query q against each row of C.
+
+Fuses L2 normalization of both sides with the dot product, so callers never
+need to pre-normalize. Returns a float32 array of C.shape[0] scores.
+"""